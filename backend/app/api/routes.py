@@ -1,20 +1,25 @@
-import hashlib
 import logging
 from datetime import datetime
 from math import inf
-from typing import List
+from typing import AsyncIterator, List
 
+import numpy as np
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from app.core.config import get_settings
 from app.core.database import get_photos_collection
 from app.schemas.photo import BoundingBox, FaceSnapshot, MatchResult, PhotoIngestionResponse, SearchResponse
-from app.services.face_analyzer import FaceEmbedding, face_analyzer
+from app.services.atlas_vector_search import INDEXED_FLAG, nearest_photo_ids, store_face_vectors
+from app.services.face_analyzer import FaceBatch, build_face_documents, face_analyzer
+from app.services.face_cache import FaceMeta, bump_version, shortlist
 from app.services.person_identifier import assign_person_id
 from app.services.media_rehydrator import ensure_media_file
 from app.services.search_reporter import search_reporter
 from app.services.storage_service import storage
+from app.services.vector_index import vector_index
+from app.utils.hashing import HASH_ALGORITHM, content_hash
 
 router = APIRouter(prefix="/api/v1")
 _settings = get_settings()
@@ -32,6 +37,23 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+def _existing_photo_response(existing_doc: dict, filename: str | None) -> PhotoIngestionResponse:
+    return PhotoIngestionResponse(
+        id=str(existing_doc["_id"]),
+        original_filename=existing_doc.get("original_filename", filename),
+        labels=existing_doc.get("labels", []),
+        media_url=storage.build_media_url(existing_doc["media_path"]),
+        faces=[
+            FaceSnapshot(
+                bounding_box=BoundingBox(**face["bounding_box"]),
+                person_id=face.get("person_id"),
+            )
+            for face in existing_doc.get("faces", [])
+        ],
+        created_at=existing_doc.get("created_at", datetime.utcnow()),
+    )
+
+
 @router.post("/photos", response_model=PhotoIngestionResponse, status_code=201)
 async def index_photo(
     file: UploadFile = File(...),
@@ -42,43 +64,22 @@ async def index_photo(
     if not payload:
         raise HTTPException(status_code=400, detail="Uploaded file is empty")
 
-    photo_hash = hashlib.sha256(payload).hexdigest()
+    photo_hash = content_hash(payload)
 
-    embeddings: List[FaceEmbedding] = face_analyzer.extract_embeddings(payload)
+    embeddings: FaceBatch = face_analyzer.embed_cached(payload, photo_hash)
     if not embeddings:
         raise HTTPException(status_code=400, detail="No faces detected in the uploaded image")
 
     existing_doc = await collection.find_one({"source_hash": photo_hash})
     if existing_doc:
-        return PhotoIngestionResponse(
-            id=str(existing_doc["_id"]),
-            original_filename=existing_doc.get("original_filename", file.filename),
-            labels=existing_doc.get("labels", []),
-            media_url=storage.build_media_url(existing_doc["media_path"]),
-            faces=[
-                FaceSnapshot(
-                    bounding_box=BoundingBox(**face["bounding_box"]),
-                    person_id=face.get("person_id"),
-                )
-                for face in existing_doc.get("faces", [])
-            ],
-            created_at=existing_doc.get("created_at", datetime.utcnow()),
-        )
+        return _existing_photo_response(existing_doc, file.filename)
 
     relative_path, _absolute_path = storage.save_bytes(payload, file.filename)
     labels_list = _parse_labels(labels)
     created_at = datetime.utcnow()
 
-    faces_payload = []
-    for embedding in embeddings:
-        person_id = await assign_person_id(embedding.encoding)
-        faces_payload.append(
-            {
-                "encoding": embedding.encoding,
-                "bounding_box": embedding.bounding_box,
-                "person_id": person_id,
-            }
-        )
+    person_ids = [await assign_person_id(encoding) for encoding in embeddings.encodings]
+    faces_payload = build_face_documents(embeddings, person_ids)
 
     document = {
         "original_filename": file.filename,
@@ -87,9 +88,24 @@ async def index_photo(
         "faces": faces_payload,
         "created_at": created_at,
         "source_hash": photo_hash,
+        "hash_algo": HASH_ALGORITHM,
     }
+    if _settings.use_atlas_vector_search:
+        document[INDEXED_FLAG] = True
 
-    insert_result = await collection.insert_one(document)
+    try:
+        insert_result = await collection.insert_one(document)
+    except DuplicateKeyError:
+        # A concurrent upload of the same image won the unique source_hash index.
+        storage.delete(relative_path)
+        existing_doc = await collection.find_one({"source_hash": photo_hash})
+        if existing_doc is None:
+            raise
+        return _existing_photo_response(existing_doc, file.filename)
+    bump_version()
+    vector_index.add(insert_result.inserted_id, embeddings.encodings, person_ids)
+    if _settings.use_atlas_vector_search:
+        await store_face_vectors([(insert_result.inserted_id, embeddings.encodings)])
 
     response = PhotoIngestionResponse(
         id=str(insert_result.inserted_id),
@@ -99,21 +115,208 @@ async def index_photo(
         faces=
         [
             FaceSnapshot(
-                bounding_box=BoundingBox(**embedding.bounding_box),
-                person_id=faces_payload[idx]["person_id"],
+                bounding_box=BoundingBox(**embeddings.bounding_box(idx)),
+                person_id=person_id,
             )
-            for idx, embedding in enumerate(embeddings)
+            for idx, person_id in enumerate(person_ids)
         ],
         created_at=created_at,
     )
     return response
 
 
-async def _ensure_media(doc: dict, collection: AsyncIOMotorCollection) -> str | None:
-    media_path = doc.get("media_path")
-    if media_path and storage.resolve_path(media_path).exists():
-        return media_path
-    return await ensure_media_file(collection, doc)
+# Scoring reads only what the distance math needs; display fields are loaded for the winners.
+_SCORE_PROJECTION = {"faces.encoding": 1, "faces.person_id": 1}
+_HYDRATE_PROJECTION = {
+    "original_filename": 1,
+    "labels": 1,
+    "media_path": 1,
+    "source_path": 1,
+    "faces.bounding_box": 1,
+    "faces.person_id": 1,
+}
+
+
+async def _shortlisted_documents(
+    collection: AsyncIOMotorCollection,
+    query_embeddings: FaceBatch,
+    limit: int,
+    threshold: float,
+    projection: dict,
+) -> AsyncIterator[dict]:
+    """Yield the documents an approximate index (Atlas, faiss or the int8 matrix) considers nearest."""
+
+    candidate_ids = None
+    if _settings.use_atlas_vector_search:
+        try:
+            candidate_ids = [
+                photo_id
+                for query_encoding in query_embeddings.encodings
+                for photo_id in await nearest_photo_ids(query_encoding, limit * 4)
+            ]
+        except OperationFailure as exc:
+            logger.warning("Atlas vector search failed, using the local shortlist: %s", exc)
+        else:
+            # A missing, misnamed or still-building index yields no hits instead of an error.
+            if not candidate_ids:
+                logger.warning("Atlas vector search returned no candidates, using the local shortlist")
+                candidate_ids = None
+
+    if candidate_ids is None:
+        if await vector_index.refresh(collection):
+            refs = [
+                ref
+                for query_encoding in query_embeddings.encodings
+                for _distance, ref in vector_index.search(query_encoding, limit * 4)
+            ]
+        else:
+            refs = await shortlist(collection, query_embeddings.encodings, limit * 4, face_analyzer.cosine_threshold(threshold))
+        candidate_ids = [ref.photo_id for ref in refs]
+
+    # dict.fromkeys drops repeats while keeping the nearest-first order.
+    photo_ids = list(dict.fromkeys(candidate_ids))
+    if not photo_ids:
+        return
+    async for doc in collection.find({"_id": {"$in": photo_ids}}, projection=projection):
+        yield doc
+
+
+async def _score_candidates(
+    collection: AsyncIOMotorCollection,
+    query_embeddings: FaceBatch,
+    limit: int,
+    threshold: float,
+) -> tuple[np.ndarray, List[FaceMeta]]:
+    """Score every shortlisted face against the query faces, reading only encodings and person ids.
+
+    Returns the (queries, faces) cosine similarity matrix and the metadata of each scored face.
+    """
+
+    face_meta: List[FaceMeta] = []
+    stored_encodings: list[bytes] = []
+    async for doc in _shortlisted_documents(collection, query_embeddings, limit, threshold, _SCORE_PROJECTION):
+        for face_index, stored_face in enumerate(doc.get("faces", [])):
+            encoding = stored_face.get("encoding")
+            if not encoding:
+                continue
+            face_meta.append(FaceMeta(photo_id=doc["_id"], face_index=face_index, person_id=stored_face.get("person_id")))
+            stored_encodings.append(encoding)
+    matrix = face_analyzer.stack_encodings(stored_encodings)
+    return face_analyzer.similarities(query_embeddings.encodings, matrix), face_meta
+
+
+def _top_indices(votes: np.ndarray, distances: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the best `limit` rows by most votes, then smallest distance, without sorting all of them."""
+
+    # Distances between unit vectors are at most 2, so a stride of 4 per vote keeps
+    # (votes desc, distance asc) ordering in a single scalar key.
+    keys = -votes * 4.0 + np.minimum(distances, 3.0)
+    if len(keys) > limit:
+        top = np.argpartition(keys, limit - 1)[:limit]
+    else:
+        top = np.arange(len(keys))
+    return top[np.argsort(keys[top], kind="stable")]
+
+
+def _top_ranked(entries: list[tuple[MatchResult, int]], limit: int) -> list[tuple[MatchResult, int]]:
+    """Best `limit` entries by most votes, then smallest distance."""
+
+    if not entries:
+        return []
+    votes = np.fromiter((entry[1] for entry in entries), dtype=np.float64, count=len(entries))
+    distances = np.fromiter(
+        (entry[0].distance if entry[0].distance is not None else inf for entry in entries),
+        dtype=np.float64,
+        count=len(entries),
+    )
+    return [entries[index] for index in _top_indices(votes, distances, limit)]
+
+
+async def _cluster_faces(
+    collection: AsyncIOMotorCollection,
+    person_id: str,
+    query_matrix: np.ndarray,
+    scores: np.ndarray,
+    face_meta: List[FaceMeta],
+    threshold: float,
+) -> List[FaceMeta]:
+    """One face of `person_id` per photo, for every photo where it is within `threshold` of a query face.
+
+    Faces scored in the first pass reuse their scores; the rest of the cluster costs one
+    extra read of encodings and person ids, scored with a single matrix product.
+    """
+
+    best_scores = scores.max(axis=0, initial=-inf)
+    members: dict[object, tuple[FaceMeta, float]] = {}
+    for ref_index, meta in enumerate(face_meta):
+        if meta.person_id == person_id and meta.photo_id not in members:
+            members[meta.photo_id] = (meta, float(best_scores[ref_index]))
+
+    scored_ids = list({meta.photo_id for meta in face_meta})
+    new_faces: List[FaceMeta] = []
+    new_encodings: list[bytes] = []
+    cursor = collection.find({"faces.person_id": person_id, "_id": {"$nin": scored_ids}}, projection=_SCORE_PROJECTION)
+    async for doc in cursor:
+        for face_index, face in enumerate(doc.get("faces", [])):
+            if face.get("person_id") == person_id:
+                if face.get("encoding"):
+                    new_faces.append(FaceMeta(photo_id=doc["_id"], face_index=face_index, person_id=person_id))
+                    new_encodings.append(face["encoding"])
+                break
+    new_scores = face_analyzer.similarities(query_matrix, face_analyzer.stack_encodings(new_encodings))
+    for meta, score in zip(new_faces, new_scores.max(axis=0, initial=-inf)):
+        members[meta.photo_id] = (meta, float(score))
+
+    min_similarity = face_analyzer.cosine_threshold(threshold)
+    return [meta for meta, score in members.values() if score >= min_similarity]
+
+
+async def _hydrate_matches(
+    collection: AsyncIOMotorCollection,
+    picks: list[tuple[FaceMeta, int, float | None]],
+) -> list[tuple[MatchResult, int]]:
+    """Load display fields for the picked faces only and build their (match, votes) entries.
+
+    Each pick is (face, votes, distance), kept in order; photos whose media cannot be
+    restored are dropped.
+    """
+
+    if not picks:
+        return []
+    cursor = collection.find({"_id": {"$in": [meta.photo_id for meta, _, _ in picks]}}, projection=_HYDRATE_PROJECTION)
+    docs_by_id = {doc["_id"]: doc async for doc in cursor}
+
+    entries: list[tuple[MatchResult, int]] = []
+    for meta, votes, distance in picks:
+        doc = docs_by_id.get(meta.photo_id)
+        if doc is None:  # removed between scoring and hydration
+            continue
+        stored_face = doc["faces"][meta.face_index]
+        media_path = await ensure_media_file(collection, doc)
+        if not media_path:
+            continue
+        # Fields come from our own documents, so skip per-field validation on this hot path;
+        # the response model still validates at the API boundary.
+        snapshot = FaceSnapshot.model_construct(
+            bounding_box=BoundingBox.model_construct(**stored_face["bounding_box"]),
+            distance=distance,
+            person_id=meta.person_id,
+        )
+        source_path = doc.get("source_path")
+        source_fallback = source_path if source_path and source_path != media_path else None
+        match = MatchResult.model_construct(
+            photo_id=str(doc["_id"]),
+            media_url=storage.build_media_url(media_path),
+            distance=distance,
+            labels=doc.get("labels", []),
+            matched_face=snapshot,
+            person_id=meta.person_id,
+            source_path=media_path,
+            content_hash=storage.compute_hash(media_path),
+            original_source_path=source_fallback,
+        )
+        entries.append((match, votes))
+    return entries
 
 
 @router.post("/search", response_model=SearchResponse)
@@ -126,74 +329,42 @@ async def search_by_face(
     if not payload:
         raise HTTPException(status_code=400, detail="Uploaded file is empty")
 
-    query_embeddings: List[FaceEmbedding] = face_analyzer.extract_embeddings(payload)
+    query_embeddings: FaceBatch = face_analyzer.extract_embeddings(payload)
     if not query_embeddings:
         raise HTTPException(status_code=400, detail="No faces detected in the query image")
 
-    entries: list[tuple[MatchResult, int]] = []
     effective_threshold = face_analyzer.distance_threshold * _settings.search_distance_multiplier
-    hash_cache: dict[str, str | None] = {}
-
-    def _media_hash(relative_path: str | None) -> str | None:
-        if not relative_path:
-            return None
-        if relative_path not in hash_cache:
-            hash_cache[relative_path] = storage.compute_hash(relative_path)
-        return hash_cache[relative_path]
+    scores, face_meta = await _score_candidates(collection, query_embeddings, limit, effective_threshold)
+
+    # Encodings are unit-normalised, so one matrix product scored every query face against every
+    # candidate face: (queries, faces) cosine similarities, thresholded in similarity space.
+    within_threshold = scores >= face_analyzer.cosine_threshold(effective_threshold)
+    face_votes = within_threshold.sum(axis=0)
+    face_best_distances = face_analyzer.distances_from_similarities(
+        np.where(within_threshold, scores, -inf).max(axis=0, initial=-inf)
+    )
 
-    projection = {"original_filename": 1, "labels": 1, "media_path": 1, "faces": 1, "source_path": 1}
-    cursor = collection.find({}, projection=projection)
-    async for doc in cursor:
-        faces = doc.get("faces", [])
-        if not faces:
-            continue
-        best_match: MatchResult | None = None
-        best_votes = 0
-        best_distance = inf
-        for stored_face in faces:
-            encoding = stored_face.get("encoding")
-            if not encoding:
-                continue
-            face_votes = 0
-            face_best_distance = inf
-            face_candidate: MatchResult | None = None
-            for query_embedding in query_embeddings:
-                distance = face_analyzer.face_distance(query_embedding.encoding, encoding)
-                if distance <= effective_threshold:
-                    face_votes += 1
-                    if distance < face_best_distance:
-                        face_best_distance = distance
-                    snapshot = FaceSnapshot(
-                        bounding_box=BoundingBox(**stored_face["bounding_box"]),
-                        distance=distance,
-                        person_id=stored_face.get("person_id"),
-                    )
-                    media_path = await _ensure_media(doc, collection)
-                    if not media_path:
-                        continue
-                    source_path = doc.get("source_path")
-                    source_fallback = source_path if source_path and source_path != media_path else None
-                    face_candidate = MatchResult(
-                        photo_id=str(doc["_id"]),
-                        media_url=storage.build_media_url(media_path),
-                        distance=distance,
-                        labels=doc.get("labels", []),
-                        matched_face=snapshot,
-                        person_id=stored_face.get("person_id"),
-                        source_path=media_path,
-                        content_hash=_media_hash(media_path),
-                        original_source_path=source_fallback,
-                    )
-            if face_candidate and (
-                best_match is None
-                or face_votes > best_votes
-                or (face_votes == best_votes and face_best_distance < best_distance)
-            ):
-                best_match = face_candidate
-                best_votes = face_votes
-                best_distance = face_best_distance
-        if best_match:
-            entries.append((best_match, best_votes))
+    # Keep the best face per photo: most query votes first, then the smallest distance.
+    best_by_photo: dict[object, tuple[int, int, float]] = {}
+    for ref_index in np.flatnonzero(face_votes):
+        photo_id = face_meta[ref_index].photo_id
+        votes = int(face_votes[ref_index])
+        distance = float(face_best_distances[ref_index])
+        current = best_by_photo.get(photo_id)
+        if current is None or votes > current[1] or (votes == current[1] and distance < current[2]):
+            best_by_photo[photo_id] = (ref_index, votes, distance)
+
+    # Only the leading photos are hydrated; twice the limit leaves room for missing media
+    # and content duplicates.
+    best = list(best_by_photo.values())
+    top = _top_indices(
+        np.array([votes for _, votes, _ in best], dtype=np.float64),
+        np.array([distance for _, _, distance in best], dtype=np.float64),
+        limit * 2,
+    )
+    entries = await _hydrate_matches(
+        collection, [(face_meta[best[index][0]], best[index][1], best[index][2]) for index in top]
+    )
 
     def _is_better(new_entry: tuple[MatchResult, int], existing_entry: tuple[MatchResult, int]) -> bool:
         new_result, new_votes = new_entry
@@ -211,14 +382,7 @@ async def search_by_face(
         if existing is None or _is_better(entry, existing):
             unique_by_media[media_key] = entry
 
-    ranked_entries = sorted(
-        unique_by_media.values(),
-        key=lambda entry: (
-            -entry[1],
-            entry[0].distance if entry[0].distance is not None else inf,
-        ),
-    )
-    ranked_entries = ranked_entries[:limit]
+    ranked_entries = _top_ranked(list(unique_by_media.values()), limit)
     matches: List[MatchResult] = [entry[0] for entry in ranked_entries]
     match_map: dict[str, MatchResult] = {match.photo_id: match for match in matches}
     media_seen = {match.content_hash or match.media_url for match in matches}
@@ -233,57 +397,26 @@ async def search_by_face(
             and primary_match.distance is not None
             and primary_match.distance <= cluster_gate
         ):
-            cluster_cursor = collection.find(
-                {"faces.person_id": primary_person_id}, projection=projection
-            )
-            async for doc in cluster_cursor:
-                if len(matches) >= limit:
-                    break
-                photo_id = str(doc["_id"])
-                if photo_id in match_map:
-                    continue
-                face = next(
-                    (face for face in doc.get("faces", []) if face.get("person_id") == primary_person_id),
-                    None,
-                )
-                if not face:
-                    continue
-                face_encoding = face.get("encoding")
-                if not face_encoding:
-                    continue
-                best_cluster_distance = min(
-                    face_analyzer.face_distance(query_embedding.encoding, face_encoding)
-                    for query_embedding in query_embeddings
+            pending = [
+                meta
+                for meta in await _cluster_faces(
+                    collection, primary_person_id, query_embeddings.encodings, scores, face_meta, effective_threshold
                 )
-                if best_cluster_distance > effective_threshold:
-                    continue
-                snapshot = FaceSnapshot(
-                    bounding_box=BoundingBox(**face["bounding_box"]),
-                    distance=None,
-                    person_id=primary_person_id,
-                )
-                media_path = await _ensure_media(doc, collection)
-                if not media_path:
-                    continue
-                source_path = doc.get("source_path")
-                source_fallback = source_path if source_path and source_path != media_path else None
-                extra_match = MatchResult(
-                    photo_id=photo_id,
-                    media_url=storage.build_media_url(media_path),
-                    distance=None,
-                    labels=doc.get("labels", []),
-                    matched_face=snapshot,
-                    person_id=primary_person_id,
-                    source_path=media_path,
-                    content_hash=_media_hash(media_path),
-                    original_source_path=source_fallback,
-                )
-                content_key = extra_match.content_hash or extra_match.media_url
-                if photo_id in match_map or content_key in media_seen:
-                    continue
-                match_map[photo_id] = extra_match
-                media_seen.add(content_key)
-                matches.append(extra_match)
+                if str(meta.photo_id) not in match_map
+            ]
+            # Hydrate in slices sized to the remaining room so large clusters are not loaded in full.
+            while pending and len(matches) < limit:
+                room = (limit - len(matches)) * 2
+                chunk, pending = pending[:room], pending[room:]
+                for extra_match, _votes in await _hydrate_matches(collection, [(meta, 0, None) for meta in chunk]):
+                    if len(matches) >= limit:
+                        break
+                    content_key = extra_match.content_hash or extra_match.media_url
+                    if extra_match.photo_id in match_map or content_key in media_seen:
+                        continue
+                    match_map[extra_match.photo_id] = extra_match
+                    media_seen.add(content_key)
+                    matches.append(extra_match)
 
     filtered_matches: List[MatchResult] = []
     for match in matches:
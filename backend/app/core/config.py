@@ -15,6 +15,7 @@ class Settings(BaseSettings):
     mongo_collection_name: str = Field(default="photos", alias="MONGO_COLLECTION_NAME")
     media_root: Path = Field(default=Path("backend/media"), alias="MEDIA_ROOT")
     media_url_prefix: str = Field(default="/media", alias="MEDIA_URL_PREFIX")
+    embed_cache_dir: Path = Field(default=Path("backend/embed_cache"), alias="EMBED_CACHE_DIR")
     face_distance_threshold: float = Field(default=0.6, alias="FACE_DISTANCE_THRESHOLD")
     allow_origins: List[str] = Field(
         default_factory=lambda: ["http://localhost:5173", "http://localhost:4200"],
@@ -26,6 +27,12 @@ class Settings(BaseSettings):
     search_distance_multiplier: float = Field(default=0.92, alias="SEARCH_DISTANCE_MULTIPLIER")
     person_id_distance_multiplier: float = Field(default=0.9, alias="PERSON_ID_DISTANCE_MULTIPLIER")
     auto_ingest_on_startup: bool = Field(default=True, alias="AUTO_INGEST_ON_STARTUP")
+    ingest_workers: Optional[int] = Field(default=None, alias="INGEST_WORKERS")
+    use_cuda_face_detector: bool = Field(default=False, alias="USE_CUDA_FACE_DETECTOR")
+    use_atlas_vector_search: bool = Field(default=False, alias="USE_ATLAS_VECTOR_SEARCH")
+    atlas_vector_index_name: str = Field(default="faces_vec", alias="ATLAS_VECTOR_INDEX_NAME")
+    atlas_vector_collection_name: str = Field(default="face_vectors", alias="ATLAS_VECTOR_COLLECTION_NAME")
+    atlas_num_candidates: int = Field(default=200, alias="ATLAS_NUM_CANDIDATES")
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore", populate_by_name=True)
 
@@ -55,6 +62,7 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     settings = Settings()
     settings.media_root = Path(settings.media_root)
+    settings.embed_cache_dir = Path(settings.embed_cache_dir)
     if settings.dataset_path:
         settings.dataset_path = Path(settings.dataset_path)
     return settings
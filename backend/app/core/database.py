@@ -1,33 +1,67 @@
+import logging
 from typing import Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
 
 from app.core.config import get_settings
 
 _settings = get_settings()
 _client: Optional[AsyncIOMotorClient] = None
 _collection: Optional[AsyncIOMotorCollection] = None
+_face_vectors_collection: Optional[AsyncIOMotorCollection] = None
+logger = logging.getLogger(__name__)
+
+SOURCE_HASH_INDEX = "source_hash_1"
 
 
 async def connect_to_mongo() -> None:
-    global _client, _collection
+    global _client, _collection, _face_vectors_collection
     if _client is not None:
         return
     _client = AsyncIOMotorClient(_settings.mongo_uri)
     db = _client[_settings.mongo_db_name]
     _collection = db[_settings.mongo_collection_name]
+    _face_vectors_collection = db[_settings.atlas_vector_collection_name]
+    await ensure_indexes()
+
+
+async def ensure_indexes() -> None:
+    """Create the indexes used by hash lookups, person clustering and media rehydration."""
+
+    collection = get_photos_collection()
+    try:
+        await collection.create_index(
+            "source_hash",
+            name=SOURCE_HASH_INDEX,
+            unique=True,
+            partialFilterExpression={"source_hash": {"$exists": True}},
+        )
+    except OperationFailure as exc:  # duplicates are purged on startup, after which this is retried
+        logger.warning("Unable to create unique source_hash index: %s", exc)
+    await collection.create_index("faces.person_id")
+    await collection.create_index("media_path")
 
 
 async def close_mongo_connection() -> None:
-    global _client, _collection
+    global _client, _collection, _face_vectors_collection
     if _client is None:
         return
     _client.close()
     _client = None
     _collection = None
+    _face_vectors_collection = None
 
 
 def get_photos_collection() -> AsyncIOMotorCollection:
     if _collection is None:
         raise RuntimeError("MongoDB collection is not initialised yet")
     return _collection
+
+
+def get_face_vectors_collection() -> AsyncIOMotorCollection:
+    """One document per stored face, holding the numeric encoding Atlas vector search indexes."""
+
+    if _face_vectors_collection is None:
+        raise RuntimeError("MongoDB collection is not initialised yet")
+    return _face_vectors_collection
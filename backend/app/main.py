@@ -6,11 +6,14 @@ from fastapi.staticfiles import StaticFiles
 
 from app.api.routes import router as api_router
 from app.core.config import get_settings
-from app.core.database import close_mongo_connection, connect_to_mongo
+from app.core.database import close_mongo_connection, connect_to_mongo, ensure_indexes, get_photos_collection
+from app.services.atlas_vector_search import ensure_vector_search_index
 from app.services.dataset_ingestor import ingest_dataset
+from app.services.encoding_migrator import migrate_face_encodings
 from app.services.person_identifier import ensure_person_ids
-from app.services.photo_deduplicator import purge_duplicate_photos
+from app.services.photo_deduplicator import purge_duplicate_photos, rehash_source_hashes
 from app.services.media_rehydrator import rehydrate_media_files
+from app.services.vector_index import vector_index
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -30,7 +33,19 @@ app.add_middleware(
 async def startup_event() -> None:
     await connect_to_mongo()
     settings.media_root.mkdir(parents=True, exist_ok=True)
+    migration = await migrate_face_encodings()
+    if migration.get("migrated"):
+        logger.info("Migrated stored face encodings", extra=migration)
+    rehash = await rehash_source_hashes()
+    if any(rehash.values()):
+        logger.info("Recomputed photo source hashes", extra=rehash)
     await ensure_person_ids()
+    indexed_faces = await vector_index.rebuild(get_photos_collection())
+    if indexed_faces:
+        logger.info("Built in-memory face index", extra={"faces": indexed_faces})
+    if settings.use_atlas_vector_search:
+        atlas_index = await ensure_vector_search_index()
+        logger.info("Atlas vector search ready", extra=atlas_index)
     if settings.auto_ingest_on_startup and settings.dataset_path:
         result = await ingest_dataset(settings.dataset_path, settings.dataset_labels)
         logger.info(
@@ -40,6 +55,8 @@ async def startup_event() -> None:
     cleanup = await purge_duplicate_photos()
     if cleanup.get("removed"):
         logger.info("Removed duplicate photos", extra=cleanup)
+        await ensure_indexes()
+        await vector_index.rebuild(get_photos_collection())
     rehydration = await rehydrate_media_files()
     if any(rehydration.values()):
         logger.info("Media rehydration results", extra=rehydration)
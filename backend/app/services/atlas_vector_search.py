@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Sequence
+
+import numpy as np
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+
+from app.core.config import get_settings
+from app.core.database import get_face_vectors_collection, get_photos_collection
+from app.services.face_analyzer import ENCODING_DIM, face_analyzer
+
+_settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# `$vectorSearch` cannot index vectors inside arrays of embedded documents, so each face
+# gets its own document in a side collection: {photo_id, face_index, encoding: [float]}.
+FACE_VECTOR_PATH = "encoding"
+INDEX_DEFINITION = {
+    "fields": [
+        {"type": "vector", "path": FACE_VECTOR_PATH, "numDimensions": ENCODING_DIM, "similarity": "euclidean"},
+    ],
+}
+# Marks photos whose faces have been copied into the face vector collection.
+INDEXED_FLAG = "face_vectors_indexed"
+
+
+def face_vector_documents(photo_id: object, encodings: np.ndarray) -> List[dict]:
+    """Numeric copies of the encodings for the Atlas index (it cannot read packed binaries)."""
+
+    return [
+        {"photo_id": photo_id, "face_index": face_index, FACE_VECTOR_PATH: encoding}
+        for face_index, encoding in enumerate(encodings.tolist())
+    ]
+
+
+async def store_face_vectors(photos: Sequence[tuple[object, np.ndarray]]) -> None:
+    """Upsert one vector document per face of each (photo id, unit-normalised encodings) pair."""
+
+    writes = [
+        ReplaceOne({"photo_id": document["photo_id"], "face_index": document["face_index"]}, document, upsert=True)
+        for photo_id, encodings in photos
+        for document in face_vector_documents(photo_id, encodings)
+    ]
+    if writes:
+        await get_face_vectors_collection().bulk_write(writes, ordered=False)
+
+
+async def delete_face_vectors(photo_ids: Sequence[object]) -> None:
+    if _settings.use_atlas_vector_search and photo_ids:
+        await get_face_vectors_collection().delete_many({"photo_id": {"$in": list(photo_ids)}})
+
+
+def vector_search_pipeline(query: np.ndarray, limit: int) -> List[dict]:
+    return [
+        {
+            "$vectorSearch": {
+                "index": _settings.atlas_vector_index_name,
+                "path": FACE_VECTOR_PATH,
+                "queryVector": np.asarray(query, dtype=np.float32).tolist(),
+                "numCandidates": max(_settings.atlas_num_candidates, limit),
+                "limit": limit,
+            }
+        },
+        {"$project": {"_id": 0, "photo_id": 1}},
+    ]
+
+
+async def nearest_photo_ids(query: np.ndarray, limit: int) -> List[object]:
+    """Ids of the photos owning the `limit` faces nearest to the query, nearest first (may repeat).
+
+    Raises `OperationFailure` when the cluster cannot run `$vectorSearch` (e.g. not Atlas),
+    and returns nothing while the index is missing or still building; callers fall back
+    to the local shortlist in both cases.
+    """
+
+    cursor = get_face_vectors_collection().aggregate(vector_search_pipeline(query, limit))
+    return [doc["photo_id"] async for doc in cursor]
+
+
+async def ensure_vector_search_index() -> Dict[str, int]:
+    """Backfill the face vector collection for older photos and create the Atlas index if missing."""
+
+    collection = get_photos_collection()
+    vectors = get_face_vectors_collection()
+    await vectors.create_index([("photo_id", 1), ("face_index", 1)], unique=True)
+
+    backfilled = 0
+    cursor = collection.find({INDEXED_FLAG: {"$ne": True}}, projection={"faces.encoding": 1})
+    async for doc in cursor:
+        encodings = [face["encoding"] for face in doc.get("faces", []) if face.get("encoding")]
+        await store_face_vectors([(doc["_id"], face_analyzer.stack_encodings(encodings))])
+        # Also drop the embedded vectors written by earlier versions of this module.
+        await collection.update_one({"_id": doc["_id"]}, {"$set": {INDEXED_FLAG: True}, "$unset": {"face_vectors": ""}})
+        backfilled += 1
+
+    created = 0
+    index_name = _settings.atlas_vector_index_name
+    try:
+        existing = [index async for index in vectors.aggregate([{"$listSearchIndexes": {"name": index_name}}])]
+        if not existing:
+            await vectors.database.command(
+                {
+                    "createSearchIndexes": vectors.name,
+                    "indexes": [{"name": index_name, "type": "vectorSearch", "definition": INDEX_DEFINITION}],
+                }
+            )
+            created = 1
+    except OperationFailure as exc:
+        logger.warning("Unable to create Atlas vector index %s: %s", index_name, exc)
+
+    return {"backfilled": backfilled, "index_created": created}
@@ -1,34 +1,226 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List
+from typing import AsyncIterator, Iterable, List
 
+import numpy as np
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+from app.core.config import get_settings
 from app.core.database import get_photos_collection
-from app.services.face_analyzer import FaceEmbedding, face_analyzer
+from app.services.atlas_vector_search import INDEXED_FLAG, store_face_vectors
+from app.services.face_analyzer import (
+    DETECTOR_BATCH_SIZE,
+    FaceBatch,
+    build_face_documents,
+    extract_embeddings_from_path,
+    face_analyzer,
+)
+from app.services.face_cache import bump_version
 from app.services.media_rehydrator import ensure_media_file
 from app.services.person_identifier import assign_person_id
 from app.services.storage_service import storage
+from app.services.vector_index import vector_index
+from app.utils.hashing import HASH_ALGORITHM, content_hash
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+INGEST_BATCH_SIZE = 256
+_settings = get_settings()
 logger = logging.getLogger(__name__)
 
 
+def _store_media_copy(file_path: Path) -> str:
+    """Stream a dataset file into media storage without holding it in memory."""
+
+    with file_path.open("rb") as handle:
+        relative_path, _ = storage.save_bytes(handle, original_filename=file_path.name)
+    return relative_path
+
+
 def iter_image_files(root: Path) -> Iterable[Path]:
     for path in sorted(root.rglob("*")):
         if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
             yield path
 
 
-def _hash_bytes(data: bytes) -> str:
-    import hashlib
+@dataclass
+class _PendingFile:
+    file_path: Path
+    embeddings: FaceBatch
+    doc_hash: str
+
+
+async def _flush_batch(
+    collection: AsyncIOMotorCollection,
+    batch: List[_PendingFile],
+    default_labels: List[str],
+) -> tuple[int, int]:
+    """Write one batch with a single hash lookup and a single bulk insert; return (indexed, skipped)."""
+
+    existing_by_hash = {}
+    cursor = collection.find(
+        {"source_hash": {"$in": [item.doc_hash for item in batch]}},
+        projection={"source_hash": 1, "media_path": 1, "source_path": 1},
+    )
+    async for doc in cursor:
+        existing_by_hash[doc["source_hash"]] = doc
+
+    indexed = skipped = 0
+    new_documents: List[tuple[dict, FaceBatch]] = []
+    pending_encodings: List[np.ndarray] = []
+    pending_person_ids: List[str] = []
+    for item in batch:
+        file_path = item.file_path
+        existing = existing_by_hash.get(item.doc_hash)
+        if existing:
+            media_path = existing.get("media_path")
+            if not (media_path and storage.exists(media_path)):
+                try:
+                    payload = await asyncio.to_thread(file_path.read_bytes)
+                except OSError:
+                    payload = None
+                await ensure_media_file(collection, existing, payload=payload, filename=file_path.name)
+            skipped += 1
+            continue
+
+        try:
+            relative_path = await asyncio.to_thread(_store_media_copy, file_path)
+        except OSError as exc:  # file might disappear mid-run
+            skipped += 1
+            logger.warning("Cannot read %s: %s", file_path, exc)
+            continue
+
+        person_ids = []
+        for encoding in item.embeddings.encodings:
+            person_id = await assign_person_id(encoding, pending_encodings, pending_person_ids)
+            pending_encodings.append(encoding)
+            pending_person_ids.append(person_id)
+            person_ids.append(person_id)
+        faces_payload = build_face_documents(item.embeddings, person_ids)
+
+        document = {
+            "_id": ObjectId(),
+            "original_filename": file_path.name,
+            "labels": default_labels,
+            "media_path": relative_path,
+            "faces": faces_payload,
+            "created_at": datetime.utcnow(),
+            "source_path": str(file_path),
+            "source_hash": item.doc_hash,
+            "hash_algo": HASH_ALGORITHM,
+        }
+        if _settings.use_atlas_vector_search:
+            document[INDEXED_FLAG] = True
+        existing_by_hash[item.doc_hash] = document
+        new_documents.append((document, item.embeddings))
+
+    if not new_documents:
+        return indexed, skipped
 
-    return hashlib.sha256(data).hexdigest()
+    failed: set[int] = set()
+    try:
+        await collection.bulk_write([InsertOne(document) for document, _ in new_documents], ordered=False)
+    except BulkWriteError as exc:
+        failed = {error["index"] for error in exc.details.get("writeErrors", [])}
+        logger.warning("Failed to insert %d photo(s) from batch", len(failed))
+    bump_version()
 
+    stored: list[tuple[object, np.ndarray]] = []
+    for position, (document, embeddings) in enumerate(new_documents):
+        if position in failed:
+            skipped += 1
+            continue
+        vector_index.add(
+            document["_id"],
+            embeddings.encodings,
+            [face["person_id"] for face in document["faces"]],
+        )
+        stored.append((document["_id"], embeddings.encodings))
+        indexed += 1
+        logger.info("Indexed %s (%d face(s))", document["source_path"], len(embeddings))
+    if _settings.use_atlas_vector_search:
+        await store_face_vectors(stored)
+    return indexed, skipped
 
-async def ingest_dataset(dataset_root: Path, default_labels: List[str] | None = None) -> dict:
-    """Walk a folder, ingesting every supported image into MongoDB."""
+
+_Extracted = tuple[Path, FaceBatch | None, str | None]
+
+
+async def _extract_in_processes(file_paths: List[Path]) -> AsyncIterator[_Extracted]:
+    """Embed files in a process pool (CPU HOG detector), yielding results as they complete.
+
+    Each result is (path, embeddings or None on failure, content hash or None for an empty file).
+    """
+
+    loop = asyncio.get_running_loop()
+    # Spawn rather than fork: forking the API process while motor/pymongo threads run can deadlock workers.
+    workers = _settings.ingest_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+
+        async def _extract(file_path: Path) -> _Extracted:
+            try:
+                embeddings, doc_hash = await loop.run_in_executor(pool, extract_embeddings_from_path, str(file_path))
+            except Exception as exc:  # file might disappear mid-run or fail to decode
+                logger.warning("Cannot extract faces from %s: %s", file_path, exc)
+                return file_path, None, None
+            return file_path, embeddings, doc_hash
+
+        for next_result in asyncio.as_completed([_extract(file_path) for file_path in file_paths]):
+            yield await next_result
+
+
+async def _extract_on_gpu(file_paths: List[Path]) -> AsyncIterator[_Extracted]:
+    """Embed files in GPU batches; a batch that fails is retried one file at a time."""
+
+    for start in range(0, len(file_paths), DETECTOR_BATCH_SIZE):
+        chunk = file_paths[start:start + DETECTOR_BATCH_SIZE]
+        readable: List[Path] = []
+        payloads: List[bytes] = []
+        hashes: List[str] = []
+        for file_path in chunk:
+            try:
+                payload = await asyncio.to_thread(file_path.read_bytes)
+            except OSError as exc:  # file might disappear mid-run
+                logger.warning("Cannot extract faces from %s: %s", file_path, exc)
+                yield file_path, None, None
+                continue
+            if not payload:
+                yield file_path, FaceBatch.empty(), None
+                continue
+            readable.append(file_path)
+            payloads.append(payload)
+            hashes.append(content_hash(payload))
+
+        try:
+            results = await asyncio.to_thread(face_analyzer.embed_cached_batch, payloads, hashes)
+        except Exception:
+            results = []
+            for file_path, payload, doc_hash in zip(readable, payloads, hashes):
+                try:
+                    results.append(await asyncio.to_thread(face_analyzer.embed_cached, payload, doc_hash))
+                except Exception as exc:
+                    logger.warning("Cannot extract faces from %s: %s", file_path, exc)
+                    results.append(None)
+        for file_path, embeddings, doc_hash in zip(readable, results, hashes):
+            yield file_path, embeddings, doc_hash
+
+
+async def ingest_dataset(
+    dataset_root: Path,
+    default_labels: List[str] | None = None,
+    batch_size: int = INGEST_BATCH_SIZE,
+) -> dict:
+    """Walk a folder, ingesting every supported image into MongoDB in unordered bulk writes of `batch_size`."""
 
     if default_labels is None:
         default_labels = []
@@ -40,58 +232,46 @@ async def ingest_dataset(dataset_root: Path, default_labels: List[str] | None =
 
     collection = get_photos_collection()
     processed = indexed = skipped = 0
+    batch: List[_PendingFile] = []
+    # Each batch is written while the next one is extracted. Only one write is in flight at a
+    # time, so every batch sees the person ids assigned by the one before it.
+    flushing: asyncio.Task | None = None
+
+    async def _finish_flush() -> None:
+        nonlocal indexed, skipped
+        if flushing is not None:
+            batch_indexed, batch_skipped = await flushing
+            indexed += batch_indexed
+            skipped += batch_skipped
 
-    for file_path in iter_image_files(dataset_root):
+    file_paths = list(iter_image_files(dataset_root))
+    extracted = _extract_on_gpu(file_paths) if face_analyzer.use_cuda else _extract_in_processes(file_paths)
+    async for file_path, embeddings, doc_hash in extracted:
         processed += 1
-        try:
-            payload = file_path.read_bytes()
-        except OSError as exc:  # file might disappear mid-run
+        if embeddings is None:
             skipped += 1
-            logger.warning("Cannot read %s: %s", file_path, exc)
             continue
 
-        if not payload:
+        if doc_hash is None:
             skipped += 1
             logger.debug("Empty file skipped: %s", file_path)
             continue
 
-        embeddings: List[FaceEmbedding] = face_analyzer.extract_embeddings(payload)
         if not embeddings:
             skipped += 1
             logger.debug("No faces detected in %s", file_path)
             continue
 
-        doc_hash = _hash_bytes(payload)
-        existing = await collection.find_one({"source_hash": doc_hash})
-        if existing:
-            await ensure_media_file(collection, existing, payload=payload, filename=file_path.name)
-            skipped += 1
-            continue
+        batch.append(_PendingFile(file_path=file_path, embeddings=embeddings, doc_hash=doc_hash))
+        if len(batch) >= batch_size:
+            await _finish_flush()
+            flushing = asyncio.create_task(_flush_batch(collection, batch, default_labels))
+            batch = []
 
-        relative_path, _ = storage.save_bytes(payload, original_filename=file_path.name)
-        faces_payload = []
-        for embedding in embeddings:
-            person_id = await assign_person_id(embedding.encoding)
-            faces_payload.append(
-                {
-                    "encoding": embedding.encoding,
-                    "bounding_box": embedding.bounding_box,
-                    "person_id": person_id,
-                }
-            )
-
-        await collection.insert_one(
-            {
-                "original_filename": file_path.name,
-                "labels": default_labels,
-                "media_path": relative_path,
-                "faces": faces_payload,
-                "created_at": datetime.utcnow(),
-                "source_path": str(file_path),
-                "source_hash": doc_hash,
-            }
-        )
-        indexed += 1
-        logger.info("Indexed %s (%d face(s))", file_path, len(embeddings))
+    await _finish_flush()
+    if batch:
+        batch_indexed, batch_skipped = await _flush_batch(collection, batch, default_labels)
+        indexed += batch_indexed
+        skipped += batch_skipped
 
     return {"processed": processed, "indexed": indexed, "skipped": skipped}
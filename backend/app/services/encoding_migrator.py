@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from typing import Dict
+
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.core.database import get_photos_collection
+from app.services.face_analyzer import ENCODING_DIM, deserialize_encoding, quantize_encodings, serialize_encoding
+from app.services.face_cache import bump_version
+
+
+async def migrate_face_encodings() -> Dict[str, int]:
+    """Pack legacy float-list encodings into float32 binaries and add missing int8 copies."""
+
+    collection: AsyncIOMotorCollection = get_photos_collection()
+    query = {
+        "$or": [
+            {"faces.encoding.0": {"$exists": True}},
+            {"faces": {"$elemMatch": {"encoding": {"$exists": True}, "encoding_i8": {"$exists": False}}}},
+        ]
+    }
+    cursor = collection.find(query, projection={"faces": 1})
+    migrated = 0
+    async for doc in cursor:
+        updated_faces = []
+        for face in doc.get("faces", []):
+            encoding = face.get("encoding")
+            if isinstance(encoding, list):
+                face["encoding"] = serialize_encoding(encoding)
+                face["dim"] = ENCODING_DIM
+            if encoding is not None and face.get("encoding_i8") is None:
+                face["encoding_i8"] = Binary(quantize_encodings(deserialize_encoding(encoding)).tobytes())
+            updated_faces.append(face)
+        await collection.update_one({"_id": doc["_id"]}, {"$set": {"faces": updated_faces}})
+        migrated += 1
+
+    if migrated:
+        bump_version()
+    return {"migrated": migrated}
@@ -1,54 +1,294 @@
 from __future__ import annotations
 
 import io
+import logging
+import os
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import List
+from pathlib import Path
+from typing import List, Sequence
 
+import cv2
 import face_recognition
 import numpy as np
+from bson import Binary
 
 from app.core.config import get_settings
+from app.utils.hashing import content_hash
 
 _settings = get_settings()
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+QUANTIZATION_SCALE = 127
+_QUANTIZED_BLOCK_ROWS = 65536
+DETECTOR_BATCH_SIZE = 32
+# Bump when detection or encoding output changes so stale cache entries are ignored.
+EMBED_CACHE_VERSION = 1
+BOX_KEYS = ("top", "right", "bottom", "left")
 
 
 @dataclass
-class FaceEmbedding:
-    encoding: List[float]
-    bounding_box: dict
+class FaceBatch:
+    """Faces found in one image, one row per face.
+
+    `encodings` is a unit-normalised float32 (N, 128) matrix and `boxes` an int32 (N, 4)
+    matrix of (top, right, bottom, left) pixel coordinates.
+    """
+
+    encodings: np.ndarray
+    boxes: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "FaceBatch":
+        return cls(
+            encodings=np.empty((0, ENCODING_DIM), dtype=np.float32),
+            boxes=np.empty((0, len(BOX_KEYS)), dtype=np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.encodings)
+
+    def bounding_box(self, index: int) -> dict:
+        return dict(zip(BOX_KEYS, self.boxes[index].tolist()))
+
+
+def serialize_encoding(encoding: np.ndarray) -> Binary:
+    """Pack an encoding into the raw float32 bytes stored in MongoDB."""
+
+    return Binary(np.asarray(encoding, dtype=np.float32).tobytes())
+
+
+def deserialize_encoding(value: bytes | Sequence[float]) -> np.ndarray:
+    """Read a stored encoding, accepting both packed float32 bytes and legacy float lists."""
+
+    if isinstance(value, (bytes, bytearray)):
+        return np.frombuffer(value, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize_encodings(encodings: np.ndarray) -> np.ndarray:
+    """Scale encodings (a vector or the rows of a matrix) to unit L2 norm."""
+
+    norms = np.linalg.norm(encodings, axis=-1, keepdims=True)
+    return encodings / np.where(norms == 0, 1, norms)
+
+
+def quantize_encodings(encodings: np.ndarray) -> np.ndarray:
+    """Map unit-normalised encodings to int8 with a fixed scale of 127."""
+
+    scaled = np.round(normalize_encodings(np.asarray(encodings, dtype=np.float32)) * QUANTIZATION_SCALE)
+    return np.clip(scaled, -QUANTIZATION_SCALE, QUANTIZATION_SCALE).astype(np.int8)
+
+
+def build_face_documents(faces: FaceBatch, person_ids: Sequence[str]) -> List[dict]:
+    """The per-face sub-documents persisted in MongoDB, one per row of the batch."""
+
+    quantized = quantize_encodings(faces.encodings)
+    return [
+        {
+            "encoding": serialize_encoding(faces.encodings[index]),
+            "encoding_i8": Binary(quantized[index].tobytes()),
+            "dim": ENCODING_DIM,
+            "bounding_box": faces.bounding_box(index),
+            "person_id": person_id,
+        }
+        for index, person_id in enumerate(person_ids)
+    ]
+
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    """Decode an upload straight into the RGB uint8 array dlib expects.
+
+    EXIF orientation is ignored to keep pixel coordinates identical to the PIL loader,
+    which is still used for formats OpenCV cannot decode (e.g. GIF).
+    """
+
+    image = cv2.imdecode(
+        np.frombuffer(image_bytes, dtype=np.uint8),
+        cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+    )
+    if image is None:
+        return face_recognition.load_image_file(io.BytesIO(image_bytes))
+    # Swap channels in place: the decoded frame is ours, so no second full-size array is needed.
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+def _cuda_available() -> bool:
+    import dlib
+
+    return bool(getattr(dlib, "DLIB_USE_CUDA", False)) and dlib.cuda.get_num_devices() > 0
 
 
 class FaceAnalyzer:
-    def __init__(self, distance_threshold: float = 0.45):
+    def __init__(self, distance_threshold: float = 0.45, use_cuda: bool = False):
         self.distance_threshold = distance_threshold
+        self.use_cuda = use_cuda and _cuda_available()
+        if use_cuda and not self.use_cuda:
+            logger.warning("CUDA face detector requested but dlib has no CUDA device; using HOG on CPU")
 
-    def extract_embeddings(self, image_bytes: bytes) -> List[FaceEmbedding]:
-        buffer = io.BytesIO(image_bytes)
-        buffer.seek(0)
-        image = face_recognition.load_image_file(buffer)
-        locations = face_recognition.face_locations(image)
-        encodings = face_recognition.face_encodings(image, known_face_locations=locations)
-        embeddings: List[FaceEmbedding] = []
-        for location, encoding in zip(locations, encodings):
-            top, right, bottom, left = location
-            embeddings.append(
-                FaceEmbedding(
-                    encoding=encoding.tolist(),
-                    bounding_box={
-                        "top": int(top),
-                        "right": int(right),
-                        "bottom": int(bottom),
-                        "left": int(left),
-                    },
-                )
-            )
+    @property
+    def detector_model(self) -> str:
+        return "cnn" if self.use_cuda else "hog"
+
+    def _cache_path(self, image_hash: str) -> Path:
+        filename = f"{image_hash}.{self.detector_model}{EMBED_CACHE_VERSION}.npy"
+        return _settings.embed_cache_dir / image_hash[:2] / filename
+
+    def _load_cached(self, image_hash: str) -> FaceBatch | None:
+        """Cached faces stored as float32 rows of 128 encoding values followed by the box."""
+
+        try:
+            rows = np.load(self._cache_path(image_hash), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        return FaceBatch(
+            encodings=np.ascontiguousarray(rows[:, :ENCODING_DIM]),
+            boxes=rows[:, ENCODING_DIM:].astype(np.int32),
+        )
+
+    def _store_cached(self, image_hash: str, faces: FaceBatch) -> None:
+        rows = np.hstack([faces.encodings, faces.boxes.astype(np.float32)])
+        path = self._cache_path(image_hash)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with temp_path.open("wb") as handle:
+                np.save(handle, rows, allow_pickle=False)
+            os.replace(temp_path, path)
+        except OSError as exc:  # the cache is an optimisation; never fail ingestion over it
+            logger.debug("Cannot write embedding cache %s: %s", path, exc)
+
+    def embed_cached(self, image_bytes: bytes, image_hash: str) -> FaceBatch:
+        """`extract_embeddings`, reusing results stored on disk for images with the same content hash."""
+
+        cached = self._load_cached(image_hash)
+        if cached is not None:
+            return cached
+        embeddings = self.extract_embeddings(image_bytes)
+        self._store_cached(image_hash, embeddings)
         return embeddings
 
+    def embed_cached_batch(self, images: Sequence[bytes], image_hashes: Sequence[str]) -> List[FaceBatch]:
+        """`extract_embeddings_batch` over the images missing from the embedding cache."""
+
+        results: List[FaceBatch | None] = [self._load_cached(image_hash) for image_hash in image_hashes]
+        misses = [position for position, cached in enumerate(results) if cached is None]
+        if misses:
+            fresh = self.extract_embeddings_batch([images[position] for position in misses])
+            for position, embeddings in zip(misses, fresh):
+                self._store_cached(image_hashes[position], embeddings)
+                results[position] = embeddings
+        return results
+
+    def extract_embeddings(self, image_bytes: bytes) -> FaceBatch:
+        image = decode_image(image_bytes)
+        locations = face_recognition.face_locations(image, model=self.detector_model)
+        return self._embed(image, locations)
+
+    def extract_embeddings_batch(self, images: Sequence[bytes]) -> List[FaceBatch]:
+        """Embed several images, running CNN detection in GPU batches when CUDA is enabled.
+
+        dlib only batches images of identical shape, so images are grouped by shape first.
+        """
+
+        if not self.use_cuda:
+            return [self.extract_embeddings(image_bytes) for image_bytes in images]
+
+        decoded = [decode_image(image_bytes) for image_bytes in images]
+        by_shape: dict[tuple, List[int]] = defaultdict(list)
+        for position, image in enumerate(decoded):
+            by_shape[image.shape].append(position)
+
+        results: List[FaceBatch] = [FaceBatch.empty() for _ in decoded]
+        for positions in by_shape.values():
+            for start in range(0, len(positions), DETECTOR_BATCH_SIZE):
+                chunk = positions[start:start + DETECTOR_BATCH_SIZE]
+                batch_locations = face_recognition.batch_face_locations(
+                    [decoded[position] for position in chunk],
+                    number_of_times_to_upsample=1,
+                    batch_size=DETECTOR_BATCH_SIZE,
+                )
+                for position, locations in zip(chunk, batch_locations):
+                    results[position] = self._embed(decoded[position], locations)
+        return results
+
+    @staticmethod
+    def _embed(image: np.ndarray, locations: List[tuple]) -> FaceBatch:
+        encodings = face_recognition.face_encodings(image, known_face_locations=locations)
+        if not encodings:
+            return FaceBatch.empty()
+        return FaceBatch(
+            encodings=normalize_encodings(np.asarray(encodings, dtype=np.float32)),
+            boxes=np.asarray(locations[:len(encodings)], dtype=np.int32).reshape(-1, len(BOX_KEYS)),
+        )
+
+    @staticmethod
+    def similarities(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query row against each matrix row, shape (queries, N).
+
+        Both sides are unit-normalised, so this is a single matrix product.
+        """
+
+        return normalize_encodings(np.asarray(queries, dtype=np.float32)) @ matrix.T
+
     @staticmethod
-    def face_distance(encoding_a: List[float], encoding_b: List[float]) -> float:
-        vector_a = np.array(encoding_a)
-        vector_b = np.array(encoding_b)
-        return float(np.linalg.norm(vector_a - vector_b))
+    def distances_from_similarities(scores: np.ndarray) -> np.ndarray:
+        """Convert cosine similarities of unit vectors back to Euclidean distances."""
+
+        return np.sqrt(np.clip(2.0 - 2.0 * scores, 0.0, None))
+
+    @staticmethod
+    def cosine_threshold(distance_threshold: float) -> float:
+        """Similarity equivalent of a Euclidean threshold on unit vectors: ||a-b||^2 = 2 - 2cos."""
+
+        return 1.0 - (distance_threshold ** 2) / 2.0
+
+    @staticmethod
+    def quantized_similarities(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarities against an int8 matrix, shape (queries, N).
+
+        NumPy has no int8 GEMM, so the matrix is upcast to float32 one block at a time;
+        products of 127-scaled int8 values stay exact in float32.
+        """
+
+        query_matrix = quantize_encodings(np.atleast_2d(queries)).astype(np.float32)
+        scores = np.empty((len(query_matrix), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), _QUANTIZED_BLOCK_ROWS):
+            block = matrix[start:start + _QUANTIZED_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = query_matrix @ block.T
+        return scores / (QUANTIZATION_SCALE * QUANTIZATION_SCALE)
+
+    def face_distances(self, query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """Euclidean distance between one query encoding and every row of a stacked (N, 128) matrix."""
+
+        if len(matrix) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self.distances_from_similarities(self.similarities(query, matrix))
+
+    @staticmethod
+    def stack_encodings(encodings: Sequence[bytes | Sequence[float]]) -> np.ndarray:
+        """Pack stored encodings into a contiguous, unit-normalised float32 matrix of shape (N, 128)."""
+
+        if not encodings:
+            return np.empty((0, ENCODING_DIM), dtype=np.float32)
+        return normalize_encodings(np.vstack([deserialize_encoding(encoding) for encoding in encodings]))
+
+
+face_analyzer = FaceAnalyzer(
+    distance_threshold=_settings.face_distance_threshold,
+    use_cuda=_settings.use_cuda_face_detector,
+)
+
+
+def extract_embeddings_from_path(path: str) -> tuple[FaceBatch, str | None]:
+    """Read, hash and embed one image file; module-level so process pools can pickle it.
 
+    Returns the faces and the content hash, which is None for an empty file.
+    """
 
-face_analyzer = FaceAnalyzer(distance_threshold=_settings.face_distance_threshold)
+    data = Path(path).read_bytes()
+    if not data:
+        return FaceBatch.empty(), None
+    image_hash = content_hash(data)
+    return face_analyzer.embed_cached(data, image_hash), image_hash
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.services.face_analyzer import ENCODING_DIM, face_analyzer
+
+# Largest similarity error int8 quantisation is allowed to introduce before a face drops off the shortlist.
+QUANTIZATION_MARGIN = 0.02
+
+
+@dataclass(frozen=True)
+class FaceMeta:
+    photo_id: object
+    face_index: int
+    person_id: Optional[str]
+
+
+_version = 0
+_cache_key: Optional[Tuple[int, int]] = None
+_cached: Optional[Tuple[np.ndarray, List[FaceMeta]]] = None
+_reload_lock = asyncio.Lock()
+
+
+def bump_version() -> None:
+    """Invalidate the cached matrix after photos or faces are written."""
+
+    global _version
+    _version += 1
+
+
+async def get_matrix(collection: AsyncIOMotorCollection) -> Tuple[np.ndarray, List[FaceMeta]]:
+    """Return every stored int8 encoding as an (N, 128) matrix plus per-row metadata.
+
+    The cache is keyed on the local version counter and the collection's document
+    count, so inserts made by another process (e.g. `scripts/bulk_index.py`) also
+    trigger a reload.
+    """
+
+    global _cache_key, _cached
+    if _cached is not None and _cache_key == (_version, await collection.estimated_document_count()):
+        return _cached
+
+    # One reload at a time: concurrent callers wait for it instead of each scanning the collection.
+    async with _reload_lock:
+        key = (_version, await collection.estimated_document_count())
+        if _cached is not None and _cache_key == key:
+            return _cached
+
+        meta: List[FaceMeta] = []
+        encodings: List[bytes] = []
+        cursor = collection.find({}, projection={"faces.encoding_i8": 1, "faces.person_id": 1})
+        async for doc in cursor:
+            for face_index, face in enumerate(doc.get("faces", [])):
+                encoding = face.get("encoding_i8")
+                if not encoding:
+                    continue
+                meta.append(FaceMeta(photo_id=doc["_id"], face_index=face_index, person_id=face.get("person_id")))
+                encodings.append(encoding)
+
+        if encodings:
+            matrix = np.frombuffer(b"".join(encodings), dtype=np.int8).reshape(len(encodings), ENCODING_DIM)
+        else:
+            matrix = np.empty((0, ENCODING_DIM), dtype=np.int8)
+        _cached = (matrix, meta)
+        _cache_key = key
+        return _cached
+
+async def shortlist(
+    collection: AsyncIOMotorCollection,
+    queries: np.ndarray,
+    k: int,
+    min_similarity: float,
+) -> List[FaceMeta]:
+    """Up to `k` stored faces most similar to any query by int8 score, best first.
+
+    Callers re-rank the shortlist against the float32 encodings before applying thresholds.
+    """
+
+    matrix, meta = await get_matrix(collection)
+    if not meta:
+        return []
+    best = face_analyzer.quantized_similarities(queries, matrix).max(axis=0)
+    candidates = np.flatnonzero(best >= min_similarity - QUANTIZATION_MARGIN)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-best[candidates], k)[:k]]
+    candidates = candidates[np.argsort(-best[candidates])]
+    return [meta[index] for index in candidates]
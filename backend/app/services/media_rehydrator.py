@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 from pathlib import Path
 from typing import Dict, Optional
@@ -22,10 +23,8 @@ async def ensure_media_file(
     """Make sure the media file referenced by a document exists on disk."""
 
     media_path = document.get("media_path")
-    if media_path:
-        absolute_path = storage.resolve_path(media_path)
-        if absolute_path.exists():
-            return media_path
+    if media_path and storage.exists(media_path):
+        return media_path
 
     data = payload
     if data is None:
@@ -34,7 +33,7 @@ async def ensure_media_file(
             source_file = Path(source_path)
             if source_file.exists():
                 try:
-                    data = source_file.read_bytes()
+                    data = await asyncio.to_thread(source_file.read_bytes)
                     filename = filename or source_file.name
                 except OSError as exc:
                     logger.warning("Unable to read source file %s: %s", source_file, exc)
@@ -55,7 +54,7 @@ async def rehydrate_media_files() -> Dict[str, int]:
     restored = missing = 0
     async for doc in cursor:
         media_path = doc.get("media_path")
-        if media_path and storage.resolve_path(media_path).exists():
+        if media_path and storage.exists(media_path):
             continue
         replacement = await ensure_media_file(collection, doc)
         if replacement:
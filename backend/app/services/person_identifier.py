@@ -1,40 +1,85 @@
 from __future__ import annotations
 
 import uuid
-from typing import List
+from typing import Optional, Sequence
 
-from motor.motor_asyncio import AsyncIOMotorCollection
+import numpy as np
 
 from app.core.config import get_settings
 from app.core.database import get_photos_collection
 from app.services.face_analyzer import face_analyzer
+from app.services.face_cache import bump_version, shortlist
+from app.services.vector_index import vector_index
 
 
 _settings = get_settings()
+_NEIGHBOR_CANDIDATES = 16
 
 
-async def _faces_cursor(collection: AsyncIOMotorCollection):
-    projection = {"faces": 1}
-    cursor = collection.find({}, projection=projection)
-    async for doc in cursor:
-        for face in doc.get("faces", []):
-            encoding = face.get("encoding")
-            if encoding:
-                yield face
+def _cluster_threshold() -> float:
+    return face_analyzer.distance_threshold * _settings.person_id_distance_multiplier
+
 
+def match_person_id(encoding: np.ndarray, matrix: np.ndarray, person_ids: Sequence[Optional[str]]) -> Optional[str]:
+    """Return the first person id whose encoding row lies within the clustering threshold."""
 
-async def assign_person_id(encoding: List[float]) -> str:
-    """Return an existing person id if the embedding matches, else create a new one."""
+    distances = face_analyzer.face_distances(encoding, matrix)
+    for hit in np.flatnonzero(distances <= _cluster_threshold()):
+        if person_ids[hit]:
+            return person_ids[hit]
+    return None
+
+
+async def find_person_id(encoding: np.ndarray) -> Optional[str]:
+    """Return the person id of a stored face matching the embedding, if any."""
 
     collection = get_photos_collection()
-    cluster_threshold = face_analyzer.distance_threshold * _settings.person_id_distance_multiplier
-    async for face in _faces_cursor(collection):
-        distance = face_analyzer.face_distance(encoding, face["encoding"])
-        if distance <= cluster_threshold:
-            person_id = face.get("person_id")
-            if person_id:
-                return person_id
-    return uuid.uuid4().hex
+    if await vector_index.refresh(collection):
+        cluster_threshold = _cluster_threshold()
+        for distance, ref in vector_index.search(encoding, _NEIGHBOR_CANDIDATES):
+            if distance > cluster_threshold:
+                break
+            if ref.person_id:
+                return ref.person_id
+        return None
+
+    candidates = await shortlist(
+        collection, encoding, _NEIGHBOR_CANDIDATES, face_analyzer.cosine_threshold(_cluster_threshold())
+    )
+    candidates = [meta for meta in candidates if meta.person_id]
+    if not candidates:
+        return None
+
+    # Re-rank the int8 shortlist (best first) against the stored float32 encodings.
+    faces_by_photo = {}
+    cursor = collection.find({"_id": {"$in": list({meta.photo_id for meta in candidates})}}, projection={"faces.encoding": 1})
+    async for doc in cursor:
+        faces_by_photo[doc["_id"]] = doc.get("faces", [])
+    person_ids: list[str] = []
+    encodings: list[bytes] = []
+    for meta in candidates:
+        faces = faces_by_photo.get(meta.photo_id, [])
+        if meta.face_index < len(faces) and faces[meta.face_index].get("encoding"):
+            person_ids.append(meta.person_id)
+            encodings.append(faces[meta.face_index]["encoding"])
+    return match_person_id(encoding, face_analyzer.stack_encodings(encodings), person_ids)
+
+
+async def assign_person_id(
+    encoding: np.ndarray,
+    pending_encodings: Sequence[np.ndarray] = (),
+    pending_person_ids: Sequence[str] = (),
+) -> str:
+    """Return an existing person id if the embedding matches, else create a new one.
+
+    `pending_*` describe faces that are about to be written but are not stored yet,
+    so photos ingested in the same batch still cluster together.
+    """
+
+    person_id = await find_person_id(encoding)
+    if person_id is None and pending_person_ids:
+        person_id = match_person_id(encoding, face_analyzer.stack_encodings(pending_encodings), pending_person_ids)
+    return person_id or uuid.uuid4().hex
 
 
 async def ensure_person_ids() -> None:
@@ -42,6 +87,7 @@ async def ensure_person_ids() -> None:
 
     collection = get_photos_collection()
     cursor = collection.find({}, projection={"faces": 1})
+    changed_any = False
     async for doc in cursor:
         updated_faces = []
         changed = False
@@ -54,3 +100,6 @@ async def ensure_person_ids() -> None:
             changed = True
         if changed:
             await collection.update_one({"_id": doc["_id"]}, {"$set": {"faces": updated_faces}})
+            changed_any = True
+    if changed_any:
+        bump_version()
@@ -1,10 +1,52 @@
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, List
 
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import DeleteMany
+from pymongo.errors import DuplicateKeyError
 
-from app.core.database import get_photos_collection
+from app.core.database import SOURCE_HASH_INDEX, get_photos_collection
+from app.services.atlas_vector_search import delete_face_vectors
+from app.services.face_cache import bump_version
+from app.services.storage_service import storage
+from app.utils.hashing import HASH_ALGORITHM, content_hash
+
+# Upper bound on the `$in` list of a single delete so huge purges stay well below the BSON size limit.
+_DELETE_BATCH_SIZE = 10_000
+
+
+async def rehash_source_hashes() -> Dict[str, int]:
+    """Recompute `source_hash` for photos hashed with an older algorithm."""
+
+    collection: AsyncIOMotorCollection = get_photos_collection()
+    query = {"source_hash": {"$exists": True}, "hash_algo": {"$ne": HASH_ALGORITHM}}
+    cursor = collection.find(query, projection={"media_path": 1, "source_path": 1})
+    rehashed = unreadable = 0
+    removed_ids: List[object] = []
+    async for doc in cursor:
+        source_hash = None
+        for candidate in (doc.get("media_path"), doc.get("source_path")):
+            view = storage.read_mmap(candidate) if candidate else None
+            if view is not None:
+                with view:
+                    source_hash = content_hash(view)
+                break
+        if source_hash is None:
+            unreadable += 1
+            continue
+        update = {"$set": {"source_hash": source_hash, "hash_algo": HASH_ALGORITHM}}
+        try:
+            await collection.update_one({"_id": doc["_id"]}, update)
+            rehashed += 1
+        except DuplicateKeyError:  # same content is already stored under the new hash
+            await collection.delete_one({"_id": doc["_id"]})
+            removed_ids.append(doc["_id"])
+
+    if removed_ids:
+        bump_version()
+        await delete_face_vectors(removed_ids)
+    return {"rehashed": rehashed, "removed": len(removed_ids), "unreadable": unreadable}
 
 
 async def purge_duplicate_photos() -> Dict[str, int]:
@@ -13,16 +55,34 @@ async def purge_duplicate_photos() -> Dict[str, int]:
     collection: AsyncIOMotorCollection = get_photos_collection()
     pipeline = [
         {"$match": {"source_hash": {"$exists": True}}},
+        {"$project": {"_id": 1, "source_hash": 1}},
         {"$group": {"_id": "$source_hash", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
         {"$match": {"count": {"$gt": 1}}},
+        # Keep the first photo of each group; only the surplus ids leave the server.
+        {"$project": {"_id": 0, "ids": {"$slice": ["$ids", 1, {"$subtract": ["$count", 1]}]}}},
     ]
 
+    # The partial source_hash index covers the $match; it is missing only while duplicates
+    # still block its creation, and hinting an absent index is an error.
+    options = {}
+    if SOURCE_HASH_INDEX in await collection.index_information():
+        options["hint"] = SOURCE_HASH_INDEX
+
+    duplicate_ids: List[object] = []
+    async for group in collection.aggregate(pipeline, **options):
+        duplicate_ids.extend(group["ids"])
+
     removed = 0
-    async for group in collection.aggregate(pipeline):
-        duplicate_ids = group["ids"][1:]
-        if not duplicate_ids:
-            continue
-        result = await collection.delete_many({"_id": {"$in": duplicate_ids}})
-        removed += result.deleted_count
+    if duplicate_ids:
+        deletes = [
+            DeleteMany({"_id": {"$in": duplicate_ids[start:start + _DELETE_BATCH_SIZE]}})
+            for start in range(0, len(duplicate_ids), _DELETE_BATCH_SIZE)
+        ]
+        result = await collection.bulk_write(deletes, ordered=False)
+        removed = result.deleted_count
+        for start in range(0, len(duplicate_ids), _DELETE_BATCH_SIZE):
+            await delete_face_vectors(duplicate_ids[start:start + _DELETE_BATCH_SIZE])
 
+    if removed:
+        bump_version()
     return {"removed": removed}
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import importlib.util
 import io
+import itertools
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import BinaryIO, List, Optional
 
 from PIL import Image
 from reportlab.lib.pagesizes import LETTER
@@ -15,6 +20,29 @@ from app.schemas.photo import MatchResult
 from app.services.storage_service import storage
 
 _settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# reportlab picks up its C helpers (string widths, number formatting) when `rl_accel` is installed.
+if importlib.util.find_spec("_rl_accel") is None:  # pragma: no cover - depends on the deployment
+    logger.warning("reportlab C accelerator (rl_accel) is not installed; PDF text layout runs in pure Python")
+# Pillow releases the GIL while decoding and resizing, so thumbnails are prepared in parallel.
+_thumbnail_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="report-thumbnails")
+
+
+class _JpegReader(ImageReader):
+    """ImageReader over JPEG bytes, which ReportLab embeds as-is (DCTDecode).
+
+    `Canvas.drawImage` calls `getRGBData()` only to fingerprint images for reuse; the compressed
+    bytes identify the image just as well without decoding every pixel.
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data))
+        self._jpeg_bytes = data
+        self._dataA = None  # normally set by getRGBData(); JPEGs carry no alpha channel
+
+    def getRGBData(self) -> bytes:
+        return self._jpeg_bytes
 
 
 class SearchReporter:
@@ -23,6 +51,8 @@ class SearchReporter:
     def __init__(self, media_root: Path):
         self._reports_root = media_root / "reports"
         self._reports_root.mkdir(parents=True, exist_ok=True)
+        # Keeps report names unique within the process even when two land on the same clock tick.
+        self._counter = itertools.count()
 
     def build_report(
         self,
@@ -32,8 +62,7 @@ class SearchReporter:
         query_faces: int,
         matches: List[MatchResult],
     ) -> str:
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"search_{timestamp}.pdf"
+        filename = f"search_{time.time_ns()}_{next(self._counter)}.pdf"
         relative_path = Path("reports") / filename
         absolute_path = self._reports_root / filename
         self._render_pdf(
@@ -54,21 +83,33 @@ class SearchReporter:
         query_faces: int,
         matches: List[MatchResult],
     ) -> None:
-        buffer = io.BytesIO()
-        pdf_canvas = canvas.Canvas(buffer, pagesize=LETTER)
+        # ReportLab writes the finished document straight to the path on save().
+        pdf_canvas = canvas.Canvas(str(output_path), pagesize=LETTER)
         width, height = LETTER
         margin = 48
         line_height = 14
 
+        current_font: tuple[str, int] | None = None
+
+        def set_font(font_name: str, font_size: int) -> None:
+            """`setFont`, skipped when that font is already active on the current page."""
+
+            nonlocal current_font
+            if current_font != (font_name, font_size):
+                pdf_canvas.setFont(font_name, font_size)
+                current_font = (font_name, font_size)
+
         def _reset_page(font_name: str = "Helvetica", font_size: int = line_height) -> float:
+            nonlocal current_font
             pdf_canvas.showPage()
-            pdf_canvas.setFont(font_name, font_size)
+            current_font = None  # every page starts from ReportLab's default font
+            set_font(font_name, font_size)
             return height - margin
 
         def draw_lines(lines: List[str], bold: bool = False, spacing: int = 4) -> float:
             nonlocal current_y
             font_name = "Helvetica-Bold" if bold else "Helvetica"
-            pdf_canvas.setFont(font_name, line_height)
+            set_font(font_name, line_height)
             for text in lines:
                 wrapped = simpleSplit(text, font_name, line_height, width - 2 * margin)
                 for fragment in wrapped:
@@ -78,17 +119,61 @@ class SearchReporter:
                     current_y -= line_height + spacing
             return current_y
 
-        def _optimized_reader(data: bytes) -> ImageReader:
-            with Image.open(io.BytesIO(data)) as image:
+        def _optimized_reader(data: bytes | BinaryIO) -> ImageReader:
+            source = io.BytesIO(data) if isinstance(data, bytes) else data
+            with Image.open(source) as image:
+                if image.format == "JPEG" and image.mode in ("RGB", "L") and max(image.size) <= 800:
+                    # Already thumbnail-sized: embed the JPEG as-is instead of re-encoding it.
+                    if source.seek(0, io.SEEK_END) < 200_000:
+                        source.seek(0)
+                        return _JpegReader(source.read())
+                if image.format == "JPEG":
+                    # Let libjpeg scale by 1/2..1/8 while decoding instead of decoding at full resolution.
+                    # draft() keeps both sides at or above the requested size, so ask for the
+                    # aspect-preserving fit of a 1600px box (twice the thumbnail size).
+                    ratio = min(1600 / image.width, 1600 / image.height)
+                    # Clamp to 1px: very wide or tall images would otherwise request a zero side.
+                    image.draft("RGB", (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))))
                 image = image.convert("RGB")
-                image.thumbnail((800, 800), Image.LANCZOS)
+                # reduce() is a cheap integer box filter; use it for whatever draft mode could not
+                # (non-JPEG sources), stopping at twice the thumbnail size before the final resample.
+                factor = max(image.size) // 1600
+                if factor > 1:
+                    image = image.reduce(factor)
+                image.thumbnail((800, 800), Image.BICUBIC)
                 optimized = io.BytesIO()
-                image.save(optimized, format="JPEG", quality=70, optimize=True)
-                optimized.seek(0)
-            return ImageReader(optimized)
+                # Standard Huffman tables and 4:2:0 chroma: a second optimisation pass is not
+                # worth its CPU for a few percent smaller thumbnails.
+                image.save(optimized, format="JPEG", quality=70, optimize=False, progressive=False, subsampling=2)
+            return _JpegReader(optimized.getvalue())
+
+        def _load_reader(path: str) -> Optional[ImageReader]:
+            stream = storage.open_stream(path)
+            if stream is None:
+                return None
+            with stream:
+                return _optimized_reader(stream)
+
+        # The same photo can back several matches; decode and shrink it once per report.
+        reader_cache: dict[str, Future] = {}
+
+        def _reader_for(path: str) -> Future:
+            if path not in reader_cache:
+                # Files queued behind busy workers are already being read ahead by the kernel.
+                storage.prefetch(path)
+                reader_cache[path] = _thumbnail_pool.submit(_load_reader, path)
+            return reader_cache[path]
+
+        # Start preparing every image before drawing; canvas calls stay on this thread
+        # because ReportLab is not thread-safe.
+        query_reader = _thumbnail_pool.submit(_optimized_reader, query_image) if query_image else None
+        for match in matches:
+            for candidate in (match.source_path, match.original_source_path):
+                if candidate and storage.exists(candidate):
+                    _reader_for(candidate)
+                    break
 
-        def draw_image(image_bytes: bytes, max_width: float, max_height: float, x: float, y: float) -> float:
-            reader = _optimized_reader(image_bytes)
+        def draw_image(reader: ImageReader, max_width: float, max_height: float, x: float, y: float) -> float:
             img_width, img_height = reader.getSize()
             scale = min(max_width / img_width, max_height / img_height, 1.0)
             draw_width = img_width * scale
@@ -97,11 +182,11 @@ class SearchReporter:
             return draw_height
 
         current_y = height - margin
-        pdf_canvas.setFont("Helvetica-Bold", 18)
+        set_font("Helvetica-Bold", 18)
         pdf_canvas.drawString(margin, current_y, "Face Search Report")
         current_y -= 28
 
-        pdf_canvas.setFont("Helvetica", line_height)
+        set_font("Helvetica", line_height)
         meta_lines = [
             f"Generated at: {datetime.utcnow().isoformat()} UTC",
             f"Query filename: {query_filename or 'unnamed upload'}",
@@ -113,16 +198,16 @@ class SearchReporter:
         if query_image:
             if current_y - 220 <= margin:
                 current_y = _reset_page()
-            pdf_canvas.setFont("Helvetica-Bold", line_height)
+            set_font("Helvetica-Bold", line_height)
             pdf_canvas.drawString(margin, current_y, "Query image")
             current_y -= line_height + 8
-            drawn_height = draw_image(query_image, max_width=width - 2 * margin, max_height=200, x=margin, y=current_y)
+            drawn_height = draw_image(query_reader.result(), max_width=width - 2 * margin, max_height=200, x=margin, y=current_y)
             current_y -= drawn_height + 16
 
         if matches:
             if current_y <= margin:
                 current_y = _reset_page()
-            pdf_canvas.setFont("Helvetica-Bold", line_height)
+            set_font("Helvetica-Bold", line_height)
             pdf_canvas.drawString(margin, current_y, "Matches")
             current_y -= line_height + 12
 
@@ -133,27 +218,27 @@ class SearchReporter:
             required_space = thumb_max_height + (line_height * 4) + 24
             if current_y - required_space <= margin:
                 current_y = _reset_page()
-                pdf_canvas.setFont("Helvetica-Bold", line_height)
+                set_font("Helvetica-Bold", line_height)
                 pdf_canvas.drawString(margin, current_y, "Matches (cont.)")
                 current_y -= line_height + 12
 
-            image_bytes = None
+            reader = None
             for candidate in (match.source_path, match.original_source_path):
                 if not candidate:
                     continue
-                image_bytes = storage.read_bytes(candidate)
-                if image_bytes:
+                reader = _reader_for(candidate).result()
+                if reader:
                     break
 
             distance = "n/a" if match.distance is None else f"{match.distance:.3f}"
             person_text = match.person_id or match.matched_face.person_id or "unknown"
             labels_text = ", ".join(match.labels) if match.labels else "none"
 
-            pdf_canvas.setFont("Helvetica-Bold", line_height)
+            set_font("Helvetica-Bold", line_height)
             pdf_canvas.drawString(margin, current_y, f"{idx}. Match")
             current_y -= line_height + 4
 
-            pdf_canvas.setFont("Helvetica", line_height)
+            set_font("Helvetica", line_height)
             pdf_canvas.drawString(margin, current_y, f"Distance: {distance}")
             current_y -= line_height + 2
             pdf_canvas.drawString(margin, current_y, f"Person ID: {person_text}")
@@ -161,16 +246,14 @@ class SearchReporter:
             pdf_canvas.drawString(margin, current_y, f"Labels: {labels_text}")
             current_y -= line_height + 6
 
-            if image_bytes:
-                drawn_height = draw_image(image_bytes, thumb_max_width, thumb_max_height, margin, current_y)
+            if reader:
+                drawn_height = draw_image(reader, thumb_max_width, thumb_max_height, margin, current_y)
                 current_y -= drawn_height + 16
             else:
                 pdf_canvas.drawString(margin, current_y, "Image unavailable")
                 current_y -= line_height + 16
 
         pdf_canvas.save()
-        buffer.seek(0)
-        output_path.write_bytes(buffer.read())
 
 
 search_reporter = SearchReporter(_settings.media_root)
@@ -1,12 +1,30 @@
-import hashlib
-import uuid
+import mmap
+import os
+import secrets
+import shutil
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import BinaryIO, Optional, Tuple
 
 from app.core.config import get_settings
+from app.utils.hashing import file_content_hash
 
 _settings = get_settings()
 
+# Searches stat the same media files over and over; a few seconds of staleness is harmless.
+_EXISTS_TTL_SECONDS = 5.0
+_EXISTS_CACHE_SIZE = 10_000
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+@lru_cache(maxsize=8192)
+def _file_hash(path: str, mtime_ns: int, size: int) -> str:
+    """Content hash of a file; mtime and size are part of the key so edits invalidate it."""
+
+    return file_content_hash(path)
+
 
 class MediaStorage:
     """Handles storing binary payloads on disk."""
@@ -14,13 +32,21 @@ class MediaStorage:
     def __init__(self, media_root: Path):
         self.media_root = media_root
         self.media_root.mkdir(parents=True, exist_ok=True)
+        self._exists_cache: OrderedDict[str, Tuple[float, bool]] = OrderedDict()
+
+    def save_bytes(self, data: bytes | BinaryIO, original_filename: str | None = None) -> Tuple[str, Path]:
+        """Store a payload under a fresh name; file-like sources are streamed in 1 MiB blocks."""
 
-    def save_bytes(self, data: bytes, original_filename: str | None = None) -> Tuple[str, Path]:
         suffix = Path(original_filename or "uploaded").suffix.lower() or ".jpg"
-        relative_path = Path("uploads") / f"{uuid.uuid4().hex}{suffix}"
+        relative_path = Path("uploads") / f"{secrets.token_hex(12)}{suffix}"
         absolute_path = self.media_root / relative_path
         absolute_path.parent.mkdir(parents=True, exist_ok=True)
-        absolute_path.write_bytes(data)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            absolute_path.write_bytes(data)
+        else:
+            with absolute_path.open("wb", buffering=_COPY_BUFFER_SIZE) as handle:
+                shutil.copyfileobj(data, handle, length=_COPY_BUFFER_SIZE)
+        self._remember_exists(relative_path.as_posix(), True)
         return relative_path.as_posix(), absolute_path
 
     def build_media_url(self, relative_path: str) -> str:
@@ -34,23 +60,68 @@ class MediaStorage:
             return path
         return self.media_root / path
 
-    def read_bytes(self, relative_path: str | Path) -> Optional[bytes]:
-        absolute_path = self.resolve_path(relative_path)
-        if not absolute_path.exists():
+    def exists(self, relative_path: str | Path) -> bool:
+        """Whether a media file exists, memoised per path for a few seconds."""
+
+        key = str(relative_path)
+        cached = self._exists_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        return self._remember_exists(key, self.resolve_path(relative_path).exists())
+
+    def delete(self, relative_path: str | Path) -> None:
+        self.resolve_path(relative_path).unlink(missing_ok=True)
+        self._remember_exists(str(relative_path), False)
+
+    def _remember_exists(self, key: str, exists: bool) -> bool:
+        self._exists_cache[key] = (time.monotonic() + _EXISTS_TTL_SECONDS, exists)
+        self._exists_cache.move_to_end(key)
+        if len(self._exists_cache) > _EXISTS_CACHE_SIZE:
+            self._exists_cache.popitem(last=False)
+        return exists
+
+    def read_mmap(self, relative_path: str | Path) -> Optional[memoryview]:
+        """Zero-copy, read-only view of a media file; None if it is missing, unreadable or empty.
+
+        Release the view (e.g. `with storage.read_mmap(path) as view:`) to unmap the file.
+        """
+
+        try:
+            with self.resolve_path(relative_path).open("rb") as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # OSError: missing, unreadable or a directory; ValueError: empty
+            return None
+        return memoryview(mapped)
+
+    def open_stream(self, relative_path: str | Path) -> Optional[BinaryIO]:
+        """Open a media file for buffered reading instead of loading it whole; None if missing."""
+
+        try:
+            return self.resolve_path(relative_path).open("rb", buffering=_COPY_BUFFER_SIZE)
+        except FileNotFoundError:
             return None
-        return absolute_path.read_bytes()
+
+    def prefetch(self, relative_path: str | Path) -> None:
+        """Ask the kernel to start reading a file ahead of use; a no-op where unsupported."""
+
+        if not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            fd = os.open(self.resolve_path(relative_path), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
 
     def compute_hash(self, relative_path: str | Path) -> Optional[str]:
         absolute_path = self.resolve_path(relative_path)
-        if not absolute_path.exists():
+        try:
+            stat = absolute_path.stat()
+        except OSError:
             return None
-        hasher = hashlib.md5()
-        with absolute_path.open("rb") as handle:
-            for chunk in iter(lambda: handle.read(8192), b""):
-                if not chunk:
-                    break
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        return _file_hash(str(absolute_path), stat.st_mtime_ns, stat.st_size)
 
 
 storage = MediaStorage(_settings.media_root)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+import numpy as np
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.services.face_analyzer import ENCODING_DIM, face_analyzer, normalize_encodings
+
+try:  # faiss is optional; without it callers fall back to scanning MongoDB.
+    import faiss
+except ImportError:  # pragma: no cover - depends on the deployment
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+_INDEX_PROJECTION = {"faces.encoding": 1, "faces.person_id": 1}
+# ObjectIds minted by other processes can trail ours by clock skew, so catch-up reads this far back.
+_CATCH_UP_SKEW = timedelta(minutes=1)
+
+
+@dataclass
+class FaceRef:
+    photo_id: object
+    face_index: int
+    person_id: Optional[str]
+
+
+class FaceVectorIndex:
+    """In-memory HNSW index over every stored face encoding.
+
+    Encodings are unit-normalised, so L2 ranking here matches cosine ranking elsewhere.
+    `refresh` compares the collection's document count with the count read when the
+    index was last synced, and catches up on photos written by another process.
+    """
+
+    def __init__(self, dim: int = ENCODING_DIM, neighbors: int = 32):
+        self._dim = dim
+        self._neighbors = neighbors
+        self._index = None
+        self._refs: List[FaceRef] = []
+        self._photo_ids: set = set()
+        self._newest: Optional[datetime] = None
+        self._documents = 0
+        self._sync_lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def add(
+        self,
+        photo_id: object,
+        encodings: np.ndarray,
+        person_ids: Sequence[Optional[str]],
+        face_indices: Sequence[int] | None = None,
+    ) -> None:
+        """Index the faces of one photo; photos that are already indexed are skipped."""
+
+        if self._index is None or photo_id in self._photo_ids:
+            return
+        self._photo_ids.add(photo_id)
+        if isinstance(photo_id, ObjectId) and (self._newest is None or photo_id.generation_time > self._newest):
+            self._newest = photo_id.generation_time
+        if len(encodings) == 0:
+            return
+        if face_indices is None:
+            face_indices = range(len(person_ids))
+        self._index.add(np.ascontiguousarray(normalize_encodings(encodings), dtype=np.float32))
+        self._refs.extend(
+            FaceRef(photo_id=photo_id, face_index=face_index, person_id=person_id)
+            for face_index, person_id in zip(face_indices, person_ids)
+        )
+
+    def _add_document(self, doc: dict) -> None:
+        faces = [(face_index, face) for face_index, face in enumerate(doc.get("faces", [])) if face.get("encoding")]
+        self.add(
+            doc["_id"],
+            face_analyzer.stack_encodings([face["encoding"] for _, face in faces]),
+            [face.get("person_id") for _, face in faces],
+            face_indices=[face_index for face_index, _ in faces],
+        )
+
+    def search(self, query: np.ndarray, k: int) -> List[tuple[float, FaceRef]]:
+        """Return up to `k` (euclidean distance, face ref) pairs, nearest first."""
+
+        if self._index is None or not self._refs:
+            return []
+        vector = normalize_encodings(np.asarray(query, dtype=np.float32))[None, :]
+        squared, ids = self._index.search(vector, min(k, len(self._refs)))
+        return [
+            (float(np.sqrt(distance)), self._refs[face_id])
+            for distance, face_id in zip(squared[0], ids[0])
+            if face_id >= 0
+        ]
+
+    async def rebuild(self, collection: AsyncIOMotorCollection) -> int:
+        if faiss is None:
+            logger.info("faiss is not installed; face search will scan MongoDB")
+            return 0
+        documents = await collection.estimated_document_count()
+        # Build into a fresh index and swap it in at the end so concurrent searches
+        # keep using the previous one instead of a half-filled one.
+        fresh = FaceVectorIndex(self._dim, self._neighbors)
+        fresh._index = faiss.IndexHNSWFlat(self._dim, self._neighbors)
+        async for doc in collection.find({}, projection=_INDEX_PROJECTION):
+            fresh._add_document(doc)
+        self._index, self._refs, self._photo_ids, self._newest = fresh._index, fresh._refs, fresh._photo_ids, fresh._newest
+        self._documents = documents
+        return len(self)
+
+    async def refresh(self, collection: AsyncIOMotorCollection) -> bool:
+        """Index photos written since the last sync if the document count moved; return `ready`.
+
+        Like `face_cache.get_matrix`, this picks up photos written by another process
+        (e.g. `scripts/bulk_index.py`) while the API is running. Only photos whose
+        ObjectId is newer than the newest indexed one (less a clock-skew allowance)
+        are read; a full rebuild happens only if that still leaves photos missing.
+        """
+
+        if self._index is None:
+            return False
+        if await collection.estimated_document_count() == self._documents:
+            return True
+        async with self._sync_lock:
+            documents = await collection.estimated_document_count()
+            if documents == self._documents:
+                return True
+            if self._newest is not None:
+                since = ObjectId.from_datetime(self._newest - _CATCH_UP_SKEW)
+                async for doc in collection.find({"_id": {"$gte": since}}, projection=_INDEX_PROJECTION):
+                    self._add_document(doc)
+            if len(self._photo_ids) < documents:
+                indexed_faces = await self.rebuild(collection)
+                logger.info("Rebuilt stale face index", extra={"faces": indexed_faces})
+            else:
+                # Any surplus is photos deleted elsewhere; their refs only cost a wasted candidate.
+                self._documents = documents
+        return self.ready
+
+vector_index = FaceVectorIndex()
@@ -0,0 +1,23 @@
+import mmap
+import os
+from pathlib import Path
+
+from blake3 import blake3
+
+HASH_ALGORITHM = "blake3"
+
+
+def content_hash(data: bytes | memoryview) -> str:
+    """Hex digest used as `source_hash` for uploaded and imported images."""
+
+    return blake3(data, max_threads=blake3.AUTO).hexdigest()
+
+
+def file_content_hash(path: str | Path) -> str:
+    """`content_hash` of a file, memory-mapped so pages go straight to the hasher without copies."""
+
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:  # empty files cannot be mapped
+            return content_hash(b"")
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return content_hash(mapped)
@@ -10,7 +10,7 @@ from typing import List
 
 from app.core.config import get_settings
 from app.core.database import close_mongo_connection, connect_to_mongo
-from app.services.dataset_ingestor import ingest_dataset
+from app.services.dataset_ingestor import INGEST_BATCH_SIZE, ingest_dataset
 
 
 def parse_args(argv: List[str]) -> argparse.Namespace:
@@ -22,16 +22,22 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         default="",
         help="Optional comma-separated labels to attach to every ingested photo.",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=INGEST_BATCH_SIZE,
+        help=f"Photos written to MongoDB per bulk insert (default {INGEST_BATCH_SIZE}).",
+    )
     return parser.parse_args(argv)
 
 
-async def main(dataset: Path, labels: List[str]) -> None:
+async def main(dataset: Path, labels: List[str], batch_size: int = INGEST_BATCH_SIZE) -> None:
     settings = get_settings()
     settings.media_root.mkdir(parents=True, exist_ok=True)
 
     await connect_to_mongo()
     try:
-        result = await ingest_dataset(dataset, labels)
+        result = await ingest_dataset(dataset, labels, batch_size=batch_size)
         print(
             f"\nDone. Indexed {result['indexed']} of {result['processed']} files from {dataset}. Skipped {result['skipped']}.")
     finally:
@@ -42,5 +48,7 @@ if __name__ == "__main__":
     args = parse_args(sys.argv[1:])
     if not args.dataset.exists():
         raise SystemExit(f"Dataset folder not found: {args.dataset}")
+    if args.batch_size < 1:
+        raise SystemExit("--batch-size must be at least 1")
     labels = [label.strip() for label in args.labels.split(",") if label.strip()]
-    asyncio.run(main(args.dataset.resolve(), labels))
+    asyncio.run(main(args.dataset.resolve(), labels, args.batch_size))